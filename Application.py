@@ -12,6 +12,7 @@ if __name__ == '__main__':
     # Create the tasks.
     print("Starting looping application.")
     tasks = YouTubeTasks()
+    tasks.startPushNotifications()
 
     # Run the loop.
     while True:
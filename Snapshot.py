@@ -0,0 +1,26 @@
+"""
+TheNexusAvenger
+
+Exports, imports, and verifies snapshots of the cache database.
+"""
+
+import argparse
+import Paths
+from YouTube.YouTubeCacheSnapshot import YouTubeCacheSnapshot
+
+
+if __name__ == '__main__':
+    # Parse the arguments.
+    parser = argparse.ArgumentParser(description="Exports, imports, and verifies snapshots of the YouTube cache.")
+    parser.add_argument("action", choices=["export", "import", "verify"], help="Action to perform with the snapshot.")
+    parser.add_argument("path", help="Path of the snapshot file.")
+    arguments = parser.parse_args()
+
+    # Perform the action.
+    snapshot = YouTubeCacheSnapshot(Paths.cacheDatabasePath)
+    if arguments.action == "export":
+        snapshot.exportSnapshot(arguments.path)
+    elif arguments.action == "import":
+        snapshot.importSnapshot(arguments.path)
+    elif arguments.action == "verify":
+        snapshot.verifySnapshot(arguments.path)
@@ -5,12 +5,20 @@ Fetches data from YouTube with caching.
 """
 
 import json
-import requests
 import sqlite3
 import Paths
 from datetime import datetime
-from typing import List
+from typing import Callable, Dict, List, Optional
 from multiprocessing.pool import ThreadPool
+from YouTube.YouTubeDataApi import sendRequest
+
+
+# Video ids read per SQLite query.
+# This is kept under the default SQLite variable limit.
+VIDEO_QUERY_SIZE = 500
+
+# Videos updated in parallel before checking if updating should stop.
+VIDEO_UPDATE_BATCH_SIZE = 50
 
 
 class Video:
@@ -19,8 +27,52 @@ class Video:
     description: str
 
 
+def readVideoRows(database: sqlite3.Connection, videoIds: List[str], columns: List[str]) -> Dict[str, tuple]:
+    """Reads columns of multiple cached videos in batches.
+
+    :param database: SQLite connection of the cache database.
+    :param videoIds: Video ids to read.
+    :param columns: Columns of the YouTubeVideos table to read.
+    :return: Values of the columns for each video id that is cached.
+    """
+
+    videoRows = {}
+    for i in range(0, len(videoIds), VIDEO_QUERY_SIZE):
+        queryVideoIds = videoIds[i:i + VIDEO_QUERY_SIZE]
+        query = "SELECT VideoId, " + ", ".join(columns) + " FROM YouTubeVideos WHERE VideoId IN (" + ",".join("?" * len(queryVideoIds)) + ");"
+        for row in database.execute(query, queryVideoIds):
+            videoRows[row[0]] = row[1:]
+    return videoRows
+
+
+def prepareDatabase(database: sqlite3.Connection) -> None:
+    """Creates the tables of the cache database if they don't exist.
+
+    :param database: SQLite connection of the cache database.
+    """
+
+    # Incremental vacuuming is enabled for new databases to allow the cache to shrink after compacting.
+    # Existing databases require a full vacuum to switch, which is done when compacting.
+    if database.execute("SELECT COUNT(*) FROM sqlite_master;").fetchone()[0] == 0:
+        database.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+    database.execute("CREATE TABLE IF NOT EXISTS YouTubeVideos (VideoId TEXT PRIMARY KEY, FetchTime TEXT NOT NULL, Title TEXT NOT NULL, Description TEXT NOT NULL);")
+    videoColumns = [row[1] for row in database.execute("PRAGMA table_info(YouTubeVideos);").fetchall()]
+    if "PublishTime" not in videoColumns:
+        database.execute("ALTER TABLE YouTubeVideos ADD COLUMN PublishTime TEXT NOT NULL DEFAULT '';")
+    if "ChangeTime" not in videoColumns:
+        database.execute("ALTER TABLE YouTubeVideos ADD COLUMN ChangeTime TEXT NOT NULL DEFAULT '';")
+    if "NextFetchTime" not in videoColumns:
+        database.execute("ALTER TABLE YouTubeVideos ADD COLUMN NextFetchTime TEXT NOT NULL DEFAULT '';")
+    if "OrphanTime" not in videoColumns:
+        database.execute("ALTER TABLE YouTubeVideos ADD COLUMN OrphanTime TEXT NOT NULL DEFAULT '';")
+    database.execute("CREATE TABLE IF NOT EXISTS PlaylistIds (PlaylistId TEXT PRIMARY KEY, FetchTime TEXT NOT NULL, VideoIds TEXT NOT NULL);")
+    database.execute("CREATE TABLE IF NOT EXISTS CacheMetadata (Key TEXT PRIMARY KEY, Value TEXT NOT NULL);")
+    database.execute("CREATE TABLE IF NOT EXISTS Leases (Name TEXT PRIMARY KEY, Owner TEXT NOT NULL, ExpireTime TEXT NOT NULL);")
+    database.commit()
+
+
 class YouTubeCacheDatabase:
-    def __init__(self, youTubeApiKey: str, videoCacheTimeSeconds: int, playlistCacheTimeSeconds: int, rollingUpdateMaxLatestVideos: int, rollingUpdateMaxOldestVideos: int):
+    def __init__(self, youTubeApiKey: str, videoCacheTimeSeconds: int, playlistCacheTimeSeconds: int, rollingUpdateMaxLatestVideos: int, rollingUpdateMaxOldestVideos: int, adaptiveUpdateMinIntervalSeconds: int = 3600, adaptiveUpdateMaxIntervalSeconds: int = 2592000, adaptiveUpdateBackoffFactor: float = 0.5, adaptiveUpdateMaxVideos: int = 50):
         """Creates the cache database.
 
         :param youTubeApiKey: API key for calling YouTube.
@@ -28,6 +80,10 @@ class YouTubeCacheDatabase:
         :param playlistCacheTimeSeconds: Time to cache playlist data.
         :param rollingUpdateMaxLatestVideos: Max latest videos to update with the rolling method.
         :param rollingUpdateMaxOldestVideos: Max oldest videos to update with the rolling method.
+        :param adaptiveUpdateMinIntervalSeconds: Minimum time between updating a video with the adaptive method.
+        :param adaptiveUpdateMaxIntervalSeconds: Maximum time between updating a video with the adaptive method.
+        :param adaptiveUpdateBackoffFactor: Multiplier of the time a video has been unchanged to wait before updating it with the adaptive method.
+        :param adaptiveUpdateMaxVideos: Max videos that are due to update with the adaptive method.
         """
 
         self.youTubeApiKey = youTubeApiKey
@@ -35,11 +91,14 @@ class YouTubeCacheDatabase:
         self.playlistCacheTimeSeconds = playlistCacheTimeSeconds
         self.rollingUpdateMaxLatestVideos = rollingUpdateMaxLatestVideos
         self.rollingUpdateMaxOldestVideos = rollingUpdateMaxOldestVideos
+        self.adaptiveUpdateMinIntervalSeconds = adaptiveUpdateMinIntervalSeconds
+        self.adaptiveUpdateMaxIntervalSeconds = adaptiveUpdateMaxIntervalSeconds
+        self.adaptiveUpdateBackoffFactor = adaptiveUpdateBackoffFactor
+        self.adaptiveUpdateMaxVideos = adaptiveUpdateMaxVideos
 
         # Prepare the database.
         database = self.openConnection()
-        database.execute("CREATE TABLE IF NOT EXISTS YouTubeVideos (VideoId TEXT PRIMARY KEY, FetchTime TEXT NOT NULL, Title TEXT NOT NULL, Description TEXT NOT NULL);")
-        database.execute("CREATE TABLE IF NOT EXISTS PlaylistIds (PlaylistId TEXT PRIMARY KEY, FetchTime TEXT NOT NULL, VideoIds TEXT NOT NULL);")
+        prepareDatabase(database)
         database.close()
 
     def openConnection(self) -> sqlite3.Connection:
@@ -48,7 +107,8 @@ class YouTubeCacheDatabase:
         :return: SQLite connection to use.
         """
 
-        return sqlite3.connect(Paths.cacheDatabasePath)
+        # The timeout is longer than the default to wait for other processes writing to the cache.
+        return sqlite3.connect(Paths.cacheDatabasePath, timeout=30)
 
     def getVideoCacheTime(self, videoId) -> datetime:
         """Returns the last time the video was fetched.
@@ -60,7 +120,7 @@ class YouTubeCacheDatabase:
         # Insert the video id record if it does not exist.
         database = self.openConnection()
         if database.execute("SELECT VideoId FROM YouTubeVideos WHERE VideoId = ? LIMIT 1;", [videoId]).fetchone() is None:
-            database.execute("INSERT INTO YouTubeVideos VALUES (?,?,'','');", [videoId, datetime.fromisocalendar(1970, 1, 1).isoformat()])
+            database.execute("INSERT INTO YouTubeVideos (VideoId, FetchTime, Title, Description) VALUES (?,?,'','');", [videoId, datetime.fromisocalendar(1970, 1, 1).isoformat()])
             database.commit()
 
         # Get the last fetch time.
@@ -68,16 +128,19 @@ class YouTubeCacheDatabase:
         database.close()
         return lastFetchTime
 
-    def getCachedVideo(self, videoId: str) -> Video:
+    def getCachedVideo(self, videoId: str) -> Optional[Video]:
         """Returns the data of a video that is cached.
         A call to update the cache *must* be used before using thsi.
 
         :param videoId: Video id to fetch.
-        :return: Data for the video.
+        :return: Data for the video, or None if the video isn't cached.
         """
 
         database = self.openConnection()
         videoData = database.execute("SELECT Title, Description FROM YouTubeVideos WHERE VideoId = ? LIMIT 1;", [videoId]).fetchone()
+        if videoData is None:
+            database.close()
+            return None
         video = Video()
         video.id = videoId
         video.title = videoData[0]
@@ -104,21 +167,96 @@ class YouTubeCacheDatabase:
         if (currentTime - lastFetchTime).total_seconds() > cacheTime:
             print("Fetching updated title and description for " + videoId)
             database = self.openConnection()
-            youTubeVideoDataResponse = requests.get("https://www.googleapis.com/youtube/v3/videos?part=snippet&id=" + videoId + "&key=" + self.youTubeApiKey)
+            youTubeVideoDataResponse = sendRequest("GET", "videos", {
+                "part": "snippet",
+                "id": videoId,
+                "fields": "items(id,snippet(title,description,publishedAt))",
+                "key": self.youTubeApiKey,
+            })
             youTubeVideoData = youTubeVideoDataResponse.json()
-            if youTubeVideoDataResponse.status_code == 403 and "quotaExceeded" in youTubeVideoDataResponse.text:
-                raise ConnectionError("YouTube API quota exceeded.")
             if "items" not in youTubeVideoData.keys():
                 raise RuntimeError("Error while getting YouTube video (HTTP " + str(youTubeVideoDataResponse.status_code) + "): " + str(youTubeVideoData))
             title = youTubeVideoData["items"][0]["snippet"]["title"]
             description = youTubeVideoData["items"][0]["snippet"]["description"]
-            database.execute("UPDATE YouTubeVideos SET FetchTime = ?, Title = ?, Description = ? WHERE VideoId = ?;", [currentTime.isoformat(), title, description, videoId])
+            publishTime = datetime.fromisoformat(youTubeVideoData["items"][0]["snippet"]["publishedAt"].replace("Z", "+00:00")).astimezone().replace(tzinfo=None)
+
+            # Track when the title or description last changed and schedule the next adaptive update.
+            # Videos fetched for the first time are treated as unchanged since they were published.
+            cachedVideoData = database.execute("SELECT Title, Description, ChangeTime FROM YouTubeVideos WHERE VideoId = ? LIMIT 1;", [videoId]).fetchone()
+            if lastFetchTime < datetime.fromisocalendar(1980, 1, 1):
+                changeTime = publishTime
+            elif cachedVideoData[0] != title or cachedVideoData[1] != description:
+                changeTime = currentTime
+            elif cachedVideoData[2] == "":
+                changeTime = publishTime
+            else:
+                changeTime = datetime.fromisoformat(cachedVideoData[2])
+            nextFetchTime = self.getNextFetchTime(currentTime, publishTime, changeTime)
+            database.execute("UPDATE YouTubeVideos SET FetchTime = ?, Title = ?, Description = ?, PublishTime = ?, ChangeTime = ?, NextFetchTime = ? WHERE VideoId = ?;", [currentTime.isoformat(), title, description, publishTime.isoformat(), changeTime.isoformat(), nextFetchTime.isoformat(), videoId])
             database.commit()
             database.close()
 
         # Return the video.
         return self.getCachedVideo(videoId)
 
+    def getVideoChannelId(self, videoId: str) -> Optional[str]:
+        """Returns the id of the channel that uploaded a video.
+        This is not cached.
+
+        :param videoId: Video id to check.
+        :return: Id of the channel of the video, or None if the video doesn't exist.
+        """
+
+        print("Fetching channel id for " + videoId)
+        youTubeVideoDataResponse = sendRequest("GET", "videos", {
+            "part": "snippet",
+            "id": videoId,
+            "fields": "items/snippet/channelId",
+            "key": self.youTubeApiKey,
+        })
+        youTubeVideoData = youTubeVideoDataResponse.json()
+        if youTubeVideoDataResponse.status_code != 200 or "error" in youTubeVideoData.keys():
+            raise RuntimeError("Error while getting YouTube video (HTTP " + str(youTubeVideoDataResponse.status_code) + "): " + str(youTubeVideoData))
+        items = youTubeVideoData.get("items", [])
+        if len(items) == 0:
+            return None
+        return items[0]["snippet"]["channelId"]
+
+    def getNextFetchTime(self, currentTime: datetime, publishTime: datetime, changeTime: datetime) -> datetime:
+        """Returns the next time a video should be updated with the adaptive method.
+        Videos that have not changed for longer wait longer before being updated again.
+
+        :param currentTime: Time the video was fetched.
+        :param publishTime: Time the video was published.
+        :param changeTime: Last time the title or description of the video was seen changing.
+        :return: Time the video should be updated next.
+        """
+
+        unchangedSeconds = (currentTime - max(publishTime, changeTime)).total_seconds()
+        intervalSeconds = min(max(unchangedSeconds * self.adaptiveUpdateBackoffFactor, self.adaptiveUpdateMinIntervalSeconds), self.adaptiveUpdateMaxIntervalSeconds)
+        return datetime.fromtimestamp(currentTime.timestamp() + intervalSeconds)
+
+    def getNextFetchTimes(self, videoIds: List[str]) -> Dict[str, datetime]:
+        """Returns the next time videos should be updated with the adaptive method.
+        Videos that were never fetched, or not fetched since the update times were tracked, are due at their last fetch time.
+
+        :param videoIds: Video ids to check.
+        :return: Next update time of each video id.
+        """
+
+        # Insert the video id records that do not exist.
+        database = self.openConnection()
+        placeholderTime = datetime.fromisocalendar(1970, 1, 1).isoformat()
+        database.executemany("INSERT OR IGNORE INTO YouTubeVideos (VideoId, FetchTime, Title, Description) VALUES (?,?,'','');", [[videoId, placeholderTime] for videoId in videoIds])
+        database.commit()
+
+        # Read the update times.
+        nextFetchTimes = {}
+        for videoId, (fetchTime, nextFetchTime) in readVideoRows(database, videoIds, ["FetchTime", "NextFetchTime"]).items():
+            nextFetchTimes[videoId] = datetime.fromisoformat(fetchTime if nextFetchTime == "" else nextFetchTime)
+        database.close()
+        return nextFetchTimes
+
     def updateCachedVideo(self, videoId: str) -> None:
         """Updates a cached video entry.
 
@@ -150,20 +288,23 @@ class YouTubeCacheDatabase:
             videoIds = []
             pageToken = None
             while True:
-                # Build the URL.
-                url = "https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&maxResults=50&playlistId=" + playlistId + "&key=" + self.youTubeApiKey
+                # Build the parameters.
+                parameters = {
+                    "part": "contentDetails",
+                    "maxResults": "50",
+                    "playlistId": playlistId,
+                    "fields": "items/contentDetails/videoId,nextPageToken",
+                    "key": self.youTubeApiKey,
+                }
                 if pageToken is not None:
-                    url += "&pageToken=" + pageToken
+                    parameters["pageToken"] = pageToken
 
                 # Add the video ids.
-                pageDataResponse = requests.get(url)
-                pageData = pageDataResponse.json()
-                if pageDataResponse.status_code == 403 and "quotaExceeded" in pageDataResponse.text:
-                    raise ConnectionError("YouTube API quota exceeded.")
+                pageData = sendRequest("GET", "playlistItems", parameters).json()
                 if "items" not in pageData.keys():
                     break
                 for item in pageData["items"]:
-                    videoIds.append(item["snippet"]["resourceId"]["videoId"])
+                    videoIds.append(item["contentDetails"]["videoId"])
 
                 # Stop the loop if there is no next page or going through pages is ignored.
                 if "nextPageToken" not in pageData.keys():
@@ -194,14 +335,22 @@ class YouTubeCacheDatabase:
 
         # Get the first 50 videos in the playlist and add them to the list.
         print("Fetching first 50 video ids for " + playlistId)
-        url = "https://youtube.googleapis.com/youtube/v3/playlistItems?part=snippet&maxResults=50&playlistId=" + playlistId + "&key=" + self.youTubeApiKey
-        pageDataResponse = requests.get(url)
+        pageDataResponse = sendRequest("GET", "playlistItems", {
+            "part": "contentDetails",
+            "maxResults": "50",
+            "playlistId": playlistId,
+            "fields": "items/contentDetails/videoId",
+            "key": self.youTubeApiKey,
+        })
         pageData = pageDataResponse.json()
-        if pageDataResponse.status_code == 403 and "quotaExceeded" in pageDataResponse.text:
-            raise ConnectionError("YouTube API quota exceeded.")
-        pageData["items"].reverse()
-        for item in pageData["items"]:
-            videoId = item["snippet"]["resourceId"]["videoId"]
+        if pageDataResponse.status_code != 200 or "error" in pageData.keys():
+            raise RuntimeError("Error while getting YouTube playlist items (HTTP " + str(pageDataResponse.status_code) + "): " + str(pageData))
+
+        # An empty playlist may not include the items in the response.
+        items = pageData.get("items", [])
+        items.reverse()
+        for item in items:
+            videoId = item["contentDetails"]["videoId"]
             if videoId not in videoIds:
                 videoIds.insert(0, videoId)
 
@@ -211,6 +360,32 @@ class YouTubeCacheDatabase:
         database.commit()
         database.close()
 
+    def addNewPlaylistVideoId(self, playlistId: str, videoId: str) -> None:
+        """Adds a new video to the start of a cached playlist if it isn't already in it.
+        This is intended for videos pushed from YouTube, so the playlist is never fetched.
+
+        :param playlistId: Id of the playlist to add to.
+        :param videoId: Id of the video to add.
+        """
+
+        # Lock the database for writing so the playlist can't change between reading and writing it.
+        database = self.openConnection()
+        database.execute("BEGIN IMMEDIATE;")
+        cachedPlaylist = database.execute("SELECT VideoIds FROM PlaylistIds WHERE PlaylistId = ? LIMIT 1;", [playlistId]).fetchone()
+        if cachedPlaylist is None:
+            # Store the playlist as expired so the rest of it is fetched when it is next listed.
+            database.execute("INSERT INTO PlaylistIds VALUES (?,?,?);", [playlistId, datetime.fromisocalendar(1970, 1, 1).isoformat(), json.dumps([videoId])])
+        else:
+            videoIds = json.loads(cachedPlaylist[0])
+            if videoId in videoIds:
+                database.rollback()
+                database.close()
+                return
+            videoIds.insert(0, videoId)
+            database.execute("UPDATE PlaylistIds SET VideoIds = ? WHERE PlaylistId = ?;", [json.dumps(videoIds), playlistId])
+        database.commit()
+        database.close()
+
     def addVideoIdToPlaylistCache(self, playlistId: str, videoId: str) -> None:
         """Adds a video as part of the cached playlist.
 
@@ -218,37 +393,67 @@ class YouTubeCacheDatabase:
         :param videoId: Id of the video to add.
         """
 
-        playlistIds = self.listPlaylistVideoIds(playlistId)
-        playlistIds.append(videoId)
+        self.addVideoIdsToPlaylistCaches({playlistId: [videoId]})
+
+    def addVideoIdsToPlaylistCaches(self, playlistVideoIds: Dict[str, List[str]]) -> None:
+        """Adds videos as part of multiple cached playlists in a single transaction.
+        Videos already in the cached playlists are not added again.
+
+        :param playlistVideoIds: Video ids to add for each playlist id.
+        """
+
+        # Lock the database for writing so the playlists can't change between reading and writing them.
         database = self.openConnection()
-        database.execute("UPDATE PlaylistIds SET VideoIds = ? WHERE PlaylistId = ?;", [json.dumps(playlistIds), playlistId])
+        database.execute("BEGIN IMMEDIATE;")
+        for playlistId, videoIds in playlistVideoIds.items():
+            # Read the current playlist ids.
+            # This is re-read in case the playlist was changed since the videos were added.
+            cachedPlaylist = database.execute("SELECT VideoIds FROM PlaylistIds WHERE PlaylistId = ? LIMIT 1;", [playlistId]).fetchone()
+            if cachedPlaylist is None:
+                continue
+            cachedVideoIds = json.loads(cachedPlaylist[0])
+
+            # Add the new video ids.
+            existingVideoIds = set(cachedVideoIds)
+            for videoId in videoIds:
+                if videoId not in existingVideoIds:
+                    cachedVideoIds.append(videoId)
+                    existingVideoIds.add(videoId)
+            database.execute("UPDATE PlaylistIds SET VideoIds = ? WHERE PlaylistId = ?;", [json.dumps(cachedVideoIds), playlistId])
         database.commit()
         database.close()
 
-    def updateVideosIds(self, updateMethod, videoIds: List[str]) -> None:
+    def updateVideosIds(self, updateMethod, videoIds: List[str], abortCheck: Optional[Callable[[], None]] = None) -> None:
         """Updates a list of videos in parallel.
 
         :param updateMethod: Update method to call.
         :param videoIds: Video ids to update.
+        :param abortCheck: Optional function called between batches of videos that throws an error to stop updating.
         """
 
         pool = ThreadPool(10)
-        pool.map(updateMethod, videoIds)
-        pool.close()
-        pool.join()
-
-    def updateCachedPlaylistVideos(self, playlistId: str, updateMethod: str) -> None:
+        try:
+            for i in range(0, len(videoIds), VIDEO_UPDATE_BATCH_SIZE):
+                if abortCheck is not None:
+                    abortCheck()
+                pool.map(updateMethod, videoIds[i:i + VIDEO_UPDATE_BATCH_SIZE])
+        finally:
+            pool.close()
+            pool.join()
+
+    def updateCachedPlaylistVideos(self, playlistId: str, updateMethod: str, abortCheck: Optional[Callable[[], None]] = None) -> None:
         """Updates the videos of a playlist.
 
         :param playlistId: Id of the playlist to update.
-        :param updateMethod: Method to update the playlist videos ("ROLLING" or "OLD").
+        :param updateMethod: Method to update the playlist videos ("ROLLING", "ADAPTIVE", or "OLD").
+        :param abortCheck: Optional function called between batches of videos that throws an error to stop updating.
         """
 
         playlistVideoIds = self.listPlaylistVideoIds(playlistId)
         if updateMethod == "OLD":
             # Updates all the videos in the playlist that are old.
             print("Updating all videos if they haven't been fetched recently.")
-            self.updateVideosIds(self.getVideo, playlistVideoIds)
+            self.updateVideosIds(self.getVideo, playlistVideoIds, abortCheck)
         elif updateMethod == "ROLLING":
             # Get the latest videos.
             print("Updating videos using a rolling method.")
@@ -282,4 +487,140 @@ class YouTubeCacheDatabase:
 
             # Update the videos.
             print("Updating " + str(len(videoIdsToUpdate)) + " videos.")
-            self.updateVideosIds(self.updateCachedVideo, videoIdsToUpdate)
\ No newline at end of file
+            self.updateVideosIds(self.updateCachedVideo, videoIdsToUpdate, abortCheck)
+        elif updateMethod == "ADAPTIVE":
+            # Get the videos that are due to update, soonest first.
+            print("Updating videos using an adaptive method.")
+            currentTime = datetime.now()
+            nextFetchTimes = self.getNextFetchTimes(playlistVideoIds)
+            dueVideoIds = sorted([videoId for videoId in nextFetchTimes.keys() if nextFetchTimes[videoId] <= currentTime], key=lambda videoId: nextFetchTimes[videoId])
+
+            # Update the videos.
+            # Videos that haven't been set up are always updated.
+            uninitializedVideoThreshold = datetime.fromisocalendar(1980, 1, 1)
+            videoIdsToUpdate = []
+            remainingVideos = self.adaptiveUpdateMaxVideos
+            for videoId in dueVideoIds:
+                if nextFetchTimes[videoId] < uninitializedVideoThreshold:
+                    videoIdsToUpdate.append(videoId)
+                elif remainingVideos > 0:
+                    videoIdsToUpdate.append(videoId)
+                    remainingVideos += -1
+            print("Updating " + str(len(videoIdsToUpdate)) + " of " + str(len(dueVideoIds)) + " due videos.")
+            self.updateVideosIds(self.updateCachedVideo, videoIdsToUpdate, abortCheck)
+
+    def getLastCompactionTime(self) -> datetime:
+        """Returns the last time the cache was compacted.
+
+        :return: Last compaction time of the cache.
+        """
+
+        database = self.openConnection()
+        lastCompactionTime = database.execute("SELECT Value FROM CacheMetadata WHERE Key = 'LastCompactionTime' LIMIT 1;").fetchone()
+        database.close()
+        if lastCompactionTime is None:
+            return datetime.fromisocalendar(1970, 1, 1)
+        return datetime.fromisoformat(lastCompactionTime[0])
+
+    def compactCache(self, playlistIds: List[str], maxCachedVideos: int, orphanedVideoCacheTimeSeconds: int) -> int:
+        """Removes videos and playlists that are no longer referenced and reclaims the unused space of the database.
+        Videos in any of the kept playlists are never removed.
+
+        :param playlistIds: Playlist ids to keep. Other playlists are removed.
+        :param maxCachedVideos: Maximum number of videos to keep, removing the oldest unreferenced videos first. 0 is unlimited.
+        :param orphanedVideoCacheTimeSeconds: Time since a video was first seen unreferenced by a compaction before it is removed.
+        :return: Number of bytes reclaimed.
+        """
+
+        database = self.openConnection()
+        pageSize = database.execute("PRAGMA page_size;").fetchone()[0]
+        initialPageCount = database.execute("PRAGMA page_count;").fetchone()[0]
+
+        # Remove the playlists that are not kept.
+        removedPlaylists = 0
+        for row in database.execute("SELECT PlaylistId FROM PlaylistIds;").fetchall():
+            if row[0] not in playlistIds:
+                database.execute("DELETE FROM PlaylistIds WHERE PlaylistId = ?;", [row[0]])
+                removedPlaylists += 1
+
+        # Store the referenced video ids.
+        database.execute("CREATE TEMP TABLE ReferencedVideoIds (VideoId TEXT PRIMARY KEY);")
+        for row in database.execute("SELECT VideoIds FROM PlaylistIds;").fetchall():
+            database.executemany("INSERT OR IGNORE INTO ReferencedVideoIds VALUES (?);", [[videoId] for videoId in json.loads(row[0])])
+
+        # Track when videos stopped being referenced.
+        # Videos that are referenced again are no longer orphaned.
+        currentTime = datetime.now()
+        database.execute("UPDATE YouTubeVideos SET OrphanTime = '' WHERE OrphanTime != '' AND VideoId IN (SELECT VideoId FROM ReferencedVideoIds);")
+        database.execute("UPDATE YouTubeVideos SET OrphanTime = ? WHERE OrphanTime = '' AND VideoId NOT IN (SELECT VideoId FROM ReferencedVideoIds);", [currentTime.isoformat()])
+
+        # Remove the unreferenced videos that were never fetched or have been unreferenced for too long.
+        uninitializedVideoThreshold = datetime.fromisocalendar(1980, 1, 1).isoformat()
+        orphanedVideoThreshold = datetime.fromtimestamp(currentTime.timestamp() - orphanedVideoCacheTimeSeconds).isoformat()
+        removedVideos = database.execute("DELETE FROM YouTubeVideos WHERE OrphanTime != '' AND (FetchTime < ? OR OrphanTime < ?);", [uninitializedVideoThreshold, orphanedVideoThreshold]).rowcount
+
+        # Remove the longest unreferenced videos if there are too many videos.
+        if maxCachedVideos > 0:
+            excessVideos = database.execute("SELECT COUNT(*) FROM YouTubeVideos;").fetchone()[0] - maxCachedVideos
+            if excessVideos > 0:
+                removedVideos += database.execute("DELETE FROM YouTubeVideos WHERE VideoId IN (SELECT VideoId FROM YouTubeVideos WHERE OrphanTime != '' ORDER BY OrphanTime, FetchTime LIMIT ?);", [excessVideos]).rowcount
+        database.execute("DROP TABLE ReferencedVideoIds;")
+        database.execute("INSERT OR REPLACE INTO CacheMetadata VALUES ('LastCompactionTime', ?);", [currentTime.isoformat()])
+        database.commit()
+
+        # Switch to incremental vacuuming if the database was created before it was enabled.
+        # This requires a full vacuum, which fails if another process is using the database.
+        if database.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            try:
+                print("Converting cache to incremental vacuuming.")
+                database.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+                database.execute("VACUUM;")
+            except sqlite3.OperationalError as e:
+                print("Unable to convert cache to incremental vacuuming. It will be retried the next compaction: " + str(e))
+
+        # Reclaim the free pages.
+        # Each step of the statement frees a page, which only runs to completion as a script.
+        database.executescript("PRAGMA incremental_vacuum;")
+        # Converting to incremental vacuuming can add pages, which isn't counted as negative space reclaimed.
+        reclaimedBytes = max(0, initialPageCount - database.execute("PRAGMA page_count;").fetchone()[0]) * pageSize
+        database.close()
+        print("Removed " + str(removedVideos) + " video(s) and " + str(removedPlaylists) + " playlist(s) from the cache, reclaiming " + str(reclaimedBytes) + " bytes.")
+        return reclaimedBytes
+
+    def acquireLease(self, name: str, owner: str, leaseTimeSeconds: int) -> bool:
+        """Attempts to acquire or renew a lease shared between processes using the cache.
+
+        :param name: Name of the lease.
+        :param owner: Unique id of the process acquiring the lease.
+        :param leaseTimeSeconds: Time until the lease expires if it isn't renewed or released.
+        :return: Whether the lease is held by the owner.
+        """
+
+        # Lock the database for writing so other processes can't acquire the lease at the same time.
+        database = self.openConnection()
+        database.execute("BEGIN IMMEDIATE;")
+        currentTime = datetime.now()
+        lease = database.execute("SELECT Owner, ExpireTime FROM Leases WHERE Name = ? LIMIT 1;", [name]).fetchone()
+        if lease is not None and lease[0] != owner and datetime.fromisoformat(lease[1]) > currentTime:
+            database.rollback()
+            database.close()
+            return False
+
+        # Store the lease.
+        expireTime = datetime.fromtimestamp(currentTime.timestamp() + leaseTimeSeconds)
+        database.execute("INSERT OR REPLACE INTO Leases VALUES (?,?,?);", [name, owner, expireTime.isoformat()])
+        database.commit()
+        database.close()
+        return True
+
+    def releaseLease(self, name: str, owner: str) -> None:
+        """Releases a lease if it is held by the owner.
+
+        :param name: Name of the lease.
+        :param owner: Unique id of the process that acquired the lease.
+        """
+
+        database = self.openConnection()
+        database.execute("DELETE FROM Leases WHERE Name = ? AND Owner = ?;", [name, owner])
+        database.commit()
+        database.close()
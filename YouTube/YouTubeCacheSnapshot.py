@@ -0,0 +1,234 @@
+"""
+TheNexusAvenger
+
+Exports and imports the cache database as a compressed snapshot.
+"""
+
+import gzip
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List
+from YouTube.YouTubeCacheDatabase import prepareDatabase
+
+SNAPSHOT_FORMAT = "YouTubePlaylistManagerCacheSnapshot"
+SNAPSHOT_VERSION = 2
+
+# Records inserted per statement when importing.
+IMPORT_BATCH_SIZE = 10000
+
+
+def migrateRecordVersion1(record: list) -> list:
+    """Migrates a record from version 1 to 2.
+    Version 2 adds the publish, change, and next fetch times to videos.
+
+    :param record: Record to migrate.
+    :return: Migrated record.
+    """
+
+    if record[0] == "V":
+        return record + ["", "", ""]
+    return record
+
+
+# Functions that convert a record from a version to the next version.
+SNAPSHOT_MIGRATIONS: Dict[int, Callable[[list], list]] = {
+    1: migrateRecordVersion1,
+}
+
+
+class SnapshotSummary:
+    version: int
+    createdTime: str
+    videos: int
+    playlists: int
+
+
+def migrateRecord(record: list, version: int) -> list:
+    """Migrates a snapshot record to the current version.
+
+    :param record: Record to migrate.
+    :param version: Version of the snapshot the record is from.
+    :return: Record for the current version.
+    """
+
+    while version < SNAPSHOT_VERSION:
+        record = SNAPSHOT_MIGRATIONS[version](record)
+        version += 1
+    return record
+
+
+class YouTubeCacheSnapshot:
+    def __init__(self, databasePath: str):
+        """Creates the cache snapshot helper.
+
+        :param databasePath: Path to the cache database.
+        """
+
+        self.databasePath = databasePath
+
+    def openConnection(self) -> sqlite3.Connection:
+        """Opens a SQLite connection to the cache database.
+
+        :return: SQLite connection to use.
+        """
+
+        database = sqlite3.connect(self.databasePath)
+        prepareDatabase(database)
+        return database
+
+    def exportSnapshot(self, snapshotPath: str) -> SnapshotSummary:
+        """Exports the videos and playlists of the cache to a snapshot.
+        The file contains a header line, a line for each record, and a footer with the counts and hash of the records.
+
+        :param snapshotPath: Path of the snapshot to write.
+        :return: Summary of the exported snapshot.
+        """
+
+        summary = SnapshotSummary()
+        summary.version = SNAPSHOT_VERSION
+        summary.createdTime = datetime.now().isoformat()
+        summary.videos = 0
+        summary.playlists = 0
+        recordsHash = hashlib.sha256()
+        database = self.openConnection()
+        with gzip.open(snapshotPath, "wt", encoding="utf8") as file:
+            # Write the header.
+            file.write(json.dumps({"Format": SNAPSHOT_FORMAT, "Version": SNAPSHOT_VERSION, "CreatedTime": summary.createdTime}) + "\n")
+
+            # Write the records.
+            # Both tables are read in the same transaction so they are consistent with each other.
+            database.execute("BEGIN;")
+            for row in database.execute("SELECT VideoId, FetchTime, Title, Description, PublishTime, ChangeTime, NextFetchTime FROM YouTubeVideos ORDER BY VideoId;"):
+                line = json.dumps(["V", row[0], row[1], row[2], row[3], row[4], row[5], row[6]], separators=(",", ":")) + "\n"
+                recordsHash.update(line.encode("utf8"))
+                file.write(line)
+                summary.videos += 1
+            for row in database.execute("SELECT PlaylistId, FetchTime, VideoIds FROM PlaylistIds ORDER BY PlaylistId;"):
+                line = json.dumps(["P", row[0], row[1], json.loads(row[2])], separators=(",", ":")) + "\n"
+                recordsHash.update(line.encode("utf8"))
+                file.write(line)
+                summary.playlists += 1
+            database.rollback()
+
+            # Write the footer.
+            file.write(json.dumps({"Videos": summary.videos, "Playlists": summary.playlists, "Sha256": recordsHash.hexdigest()}) + "\n")
+        database.close()
+        print("Exported " + str(summary.videos) + " video(s) and " + str(summary.playlists) + " playlist(s) to " + snapshotPath)
+        return summary
+
+    def readSnapshot(self, snapshotPath: str, summary: SnapshotSummary) -> Iterator[list]:
+        """Reads the records of a snapshot, migrated to the current version.
+        The records are verified against the footer once they are all read.
+
+        :param snapshotPath: Path of the snapshot to read.
+        :param summary: Summary to populate while reading.
+        :return: Records of the snapshot.
+        """
+
+        with gzip.open(snapshotPath, "rt", encoding="utf8") as file:
+            # Read the header.
+            header = json.loads(file.readline())
+            if header.get("Format") != SNAPSHOT_FORMAT:
+                raise RuntimeError("File is not a cache snapshot: " + snapshotPath)
+            if header["Version"] > SNAPSHOT_VERSION:
+                raise RuntimeError("Snapshot version " + str(header["Version"]) + " is newer than the supported version " + str(SNAPSHOT_VERSION) + ".")
+            summary.version = header["Version"]
+            summary.createdTime = header["CreatedTime"]
+            summary.videos = 0
+            summary.playlists = 0
+
+            # Read the records.
+            recordsHash = hashlib.sha256()
+            footer = None
+            for line in file:
+                if line.startswith("{"):
+                    footer = json.loads(line)
+                    break
+                recordsHash.update(line.encode("utf8"))
+                record = json.loads(line)
+                if record[0] == "V":
+                    summary.videos += 1
+                elif record[0] == "P":
+                    summary.playlists += 1
+                yield migrateRecord(record, summary.version)
+
+            # Verify the records.
+            if footer is None:
+                raise RuntimeError("Snapshot is incomplete (no footer): " + snapshotPath)
+            if footer["Videos"] != summary.videos or footer["Playlists"] != summary.playlists:
+                raise RuntimeError("Snapshot record counts do not match (expected " + str(footer["Videos"]) + " video(s) and " + str(footer["Playlists"]) + " playlist(s), read " + str(summary.videos) + " and " + str(summary.playlists) + ").")
+            if footer["Sha256"] != recordsHash.hexdigest():
+                raise RuntimeError("Snapshot hash does not match. The file may be corrupted: " + snapshotPath)
+
+    def verifySnapshot(self, snapshotPath: str) -> SnapshotSummary:
+        """Verifies the records of a snapshot without importing it.
+        An error is thrown if the snapshot is invalid.
+
+        :param snapshotPath: Path of the snapshot to verify.
+        :return: Summary of the snapshot.
+        """
+
+        summary = SnapshotSummary()
+        for _ in self.readSnapshot(snapshotPath, summary):
+            pass
+        print("Verified " + str(summary.videos) + " video(s) and " + str(summary.playlists) + " playlist(s) in " + snapshotPath + " (version " + str(summary.version) + ", created " + summary.createdTime + ").")
+        return summary
+
+    def importSnapshot(self, snapshotPath: str) -> SnapshotSummary:
+        """Imports a snapshot into the cache.
+        Cached entries are only replaced if the snapshot entry was fetched more recently.
+        Nothing is imported if the snapshot fails verification.
+
+        :param snapshotPath: Path of the snapshot to import.
+        :return: Summary of the imported snapshot.
+        """
+
+        summary = SnapshotSummary()
+        database = self.openConnection()
+        try:
+            # Insert the records in batches.
+            videoRows: List[list] = []
+            playlistRows: List[list] = []
+            for record in self.readSnapshot(snapshotPath, summary):
+                if record[0] == "V":
+                    videoRows.append(record[1:])
+                elif record[0] == "P":
+                    playlistRows.append([record[1], record[2], json.dumps(record[3])])
+                if len(videoRows) >= IMPORT_BATCH_SIZE:
+                    self.insertVideoRows(database, videoRows)
+                    videoRows = []
+                if len(playlistRows) >= IMPORT_BATCH_SIZE:
+                    self.insertPlaylistRows(database, playlistRows)
+                    playlistRows = []
+            self.insertVideoRows(database, videoRows)
+            self.insertPlaylistRows(database, playlistRows)
+
+            # Store the records.
+            database.commit()
+        except Exception:
+            database.rollback()
+            raise
+        finally:
+            database.close()
+        print("Imported " + str(summary.videos) + " video(s) and " + str(summary.playlists) + " playlist(s) from " + snapshotPath)
+        return summary
+
+    def insertVideoRows(self, database: sqlite3.Connection, videoRows: List[list]) -> None:
+        """Inserts video rows from a snapshot.
+
+        :param database: SQLite connection to insert with.
+        :param videoRows: Rows of the videos to insert.
+        """
+
+        database.executemany("INSERT INTO YouTubeVideos (VideoId, FetchTime, Title, Description, PublishTime, ChangeTime, NextFetchTime) VALUES (?,?,?,?,?,?,?) ON CONFLICT (VideoId) DO UPDATE SET FetchTime = excluded.FetchTime, Title = excluded.Title, Description = excluded.Description, PublishTime = excluded.PublishTime, ChangeTime = excluded.ChangeTime, NextFetchTime = excluded.NextFetchTime WHERE excluded.FetchTime > YouTubeVideos.FetchTime;", videoRows)
+
+    def insertPlaylistRows(self, database: sqlite3.Connection, playlistRows: List[list]) -> None:
+        """Inserts playlist rows from a snapshot.
+
+        :param database: SQLite connection to insert with.
+        :param playlistRows: Rows of the playlists to insert.
+        """
+
+        database.executemany("INSERT INTO PlaylistIds (PlaylistId, FetchTime, VideoIds) VALUES (?,?,?) ON CONFLICT (PlaylistId) DO UPDATE SET FetchTime = excluded.FetchTime, VideoIds = excluded.VideoIds WHERE excluded.FetchTime > PlaylistIds.FetchTime;", playlistRows)
@@ -0,0 +1,61 @@
+"""
+TheNexusAvenger
+
+Sends requests to the YouTube Data API with minimal response payloads.
+"""
+
+import requests
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlencode
+
+YOUTUBE_DATA_API_URL = "https://www.googleapis.com/youtube/v3/"
+
+# Google only compresses responses if the user agent also contains "gzip".
+REQUEST_HEADERS = {
+    "Accept-Encoding": "gzip",
+    "User-Agent": "YouTube-Playlist-Manager (gzip)",
+}
+
+sessions = threading.local()
+
+
+def getSession() -> requests.Session:
+    """Returns the session for the current thread.
+    Sessions keep connections open between requests, but are not safe to share between threads.
+
+    :return: Session to send requests with.
+    """
+
+    if not hasattr(sessions, "session"):
+        sessions.session = requests.Session()
+        sessions.session.headers.update(REQUEST_HEADERS)
+    return sessions.session
+
+
+def buildUrl(resource: str, parameters: Dict[str, str]) -> str:
+    """Builds the URL for a YouTube Data API resource.
+
+    :param resource: Resource to request, such as "videos" or "playlistItems".
+    :param parameters: Query parameters of the request. This should include "fields" to limit the response.
+    :return: URL of the request.
+    """
+
+    return YOUTUBE_DATA_API_URL + resource + "?" + urlencode(parameters)
+
+
+def sendRequest(method: str, resource: str, parameters: Dict[str, str], headers: Optional[Dict[str, str]] = None, body: Optional[dict] = None) -> requests.Response:
+    """Sends a request to the YouTube Data API.
+
+    :param method: HTTP method of the request.
+    :param resource: Resource to request, such as "videos" or "playlistItems".
+    :param parameters: Query parameters of the request. This should include "fields" to limit the response.
+    :param headers: Optional additional headers of the request.
+    :param body: Optional JSON body of the request.
+    :return: Response of the request.
+    """
+
+    response = getSession().request(method, buildUrl(resource, parameters), headers=headers, json=body)
+    if response.status_code == 403 and "quotaExceeded" in response.text:
+        raise ConnectionError("YouTube API quota exceeded.")
+    return response
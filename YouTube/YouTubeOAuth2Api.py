@@ -10,9 +10,11 @@ import urllib
 import json
 import os
 import Paths
+from typing import Dict, List, Set
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse
 from YouTube.YouTubeCacheDatabase import YouTubeCacheDatabase
+from YouTube.YouTubeDataApi import sendRequest
 
 staticYouTubeOAuth2Api = None
 
@@ -180,22 +182,42 @@ class YouTubeOAuth2Api:
             print("Authorization failed. Refresh token may be invalid.")
             return self.getAuthorizationHeader()
 
+    def startInsertionSession(self) -> "YouTubePlaylistInsertionSession":
+        """Starts a session for adding multiple videos to playlists.
+
+        :return: Session to add videos with.
+        """
+
+        return YouTubePlaylistInsertionSession(self)
+
     def addToPlaylist(self, playlistId: str, videoId: str) -> None:
         """Adds a video to a playlist.
+        For adding multiple videos, startInsertionSession should be used instead.
 
         :param playlistId: Id of the playlist to add to.
         :param videoId: Id of the video to add.
         """
 
-        # Return if the video already exists on the playlist.
-        if videoId in self.youTubeCacheDatabase.listPlaylistVideoIds(playlistId):
-            return
+        with self.startInsertionSession() as session:
+            session.addToPlaylist(playlistId, videoId)
+
+    def insertPlaylistItem(self, playlistId: str, videoId: str) -> None:
+        """Sends the request to add a video to a playlist.
+        The playlist cache is not checked or updated.
+
+        :param playlistId: Id of the playlist to add to.
+        :param videoId: Id of the video to add.
+        """
 
         # Add the video.
-        response = requests.post("https://www.googleapis.com/youtube/v3/playlistItems?part=snippet&key=" + self.apiKey,
-            headers={
+        # The quota being reached throws an error when sending.
+        response = sendRequest("POST", "playlistItems", {
+                "part": "snippet",
+                "fields": "id",
+                "key": self.apiKey,
+            }, headers={
                 "Authorization": self.getAuthorizationHeader()
-            }, json={
+            }, body={
                 "snippet": {
                     "playlistId": playlistId,
                     "resourceId": {
@@ -205,12 +227,65 @@ class YouTubeOAuth2Api:
                 }
             })
 
-        # Throw an error if the quota was reached.
-        if response.status_code == 403 and "quotaExceeded" in response.text:
-            raise ConnectionError("YouTube API quota exceeded.")
-        elif response.status_code != 200:
+        # Throw an error if the video wasn't added.
+        if response.status_code != 200:
             raise RuntimeError("Video not added to playlist (HTTP " + str(response.status_code) + "): " + response.text)
-
-        # Add the video id to the playlist cache.
         print("Added video " + videoId + " to playlist " + playlistId)
-        self.youTubeCacheDatabase.addVideoIdToPlaylistCache(playlistId, videoId)
+
+
+class YouTubePlaylistInsertionSession:
+    def __init__(self, oauth2Api: YouTubeOAuth2Api):
+        """Creates a playlist insertion session.
+        The video ids of each playlist are read once, and the added videos are stored in the cache when flushed.
+
+        :param oauth2Api: YouTube OAuth2 API helper to add videos with.
+        """
+
+        self.oauth2Api = oauth2Api
+        self.playlistVideoIds: Dict[str, Set[str]] = {}
+        self.addedVideoIds: Dict[str, List[str]] = {}
+
+    def __enter__(self) -> "YouTubePlaylistInsertionSession":
+        """Enters the session.
+
+        :return: The session.
+        """
+
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback) -> None:
+        """Exits the session, storing the added videos even if an error was thrown.
+        """
+
+        self.flush()
+
+    def addToPlaylist(self, playlistId: str, videoId: str) -> None:
+        """Adds a video to a playlist.
+
+        :param playlistId: Id of the playlist to add to.
+        :param videoId: Id of the video to add.
+        """
+
+        # Read the playlist ids if they weren't read before.
+        if playlistId not in self.playlistVideoIds.keys():
+            self.playlistVideoIds[playlistId] = set(self.oauth2Api.youTubeCacheDatabase.listPlaylistVideoIds(playlistId))
+
+        # Return if the video already exists on the playlist.
+        if videoId in self.playlistVideoIds[playlistId]:
+            return
+
+        # Add the video.
+        self.oauth2Api.insertPlaylistItem(playlistId, videoId)
+        self.playlistVideoIds[playlistId].add(videoId)
+        if playlistId not in self.addedVideoIds.keys():
+            self.addedVideoIds[playlistId] = []
+        self.addedVideoIds[playlistId].append(videoId)
+
+    def flush(self) -> None:
+        """Stores the added videos in the playlist cache.
+        """
+
+        if len(self.addedVideoIds) == 0:
+            return
+        self.oauth2Api.youTubeCacheDatabase.addVideoIdsToPlaylistCaches(self.addedVideoIds)
+        self.addedVideoIds = {}
@@ -3,13 +3,77 @@ TheNexusAvenger
 
 Manages the state of playlists.
 """
+import multiprocessing
 import os.path
+import sqlite3
 
 import Paths
-from typing import Dict, List
-from YouTube.YouTubeCacheDatabase import YouTubeCacheDatabase, Video
+from typing import Callable, Dict, List, Optional, Tuple
+from YouTube.YouTubeCacheDatabase import YouTubeCacheDatabase, Video, readVideoRows
 from YouTube.YouTubeOAuth2Api import YouTubeOAuth2Api
 
+# Minimum videos for each process when classifying in parallel.
+# Below this, starting the processes takes longer than classifying in the current process.
+MIN_VIDEOS_PER_CLASSIFICATION_PROCESS = 500
+
+
+def containsKeyword(keywords: List[str], title: str, description: str) -> bool:
+    """Returns if a title or description contains any of the keywords.
+
+    :param keywords: Lowercase keywords to match for.
+    :param title: Title of the video.
+    :param description: Description of the video.
+    :return: Whether any keyword was found.
+    """
+
+    title = title.lower()
+    description = description.lower()
+    for keyword in keywords:
+        if keyword in title or keyword in description:
+            return True
+    return False
+
+
+def classifyVideoShard(databasePath: str, videoIds: List[str], playlists: Dict[str, Tuple[List[str], List[str]]]) -> Tuple[Dict[str, Tuple[str, str]], Dict[str, Tuple[List[str], List[str], List[str]]]]:
+    """Classifies a shard of video ids for all the playlists.
+    This is run in a worker process, so the videos are read directly from the cache database.
+
+    :param databasePath: Path to the cache database.
+    :param videoIds: Video ids of the shard to classify.
+    :param playlists: Keywords and current video ids of each playlist id.
+    :return: Titles and descriptions of the videos in any list, and the video ids to add, keep, and remove for each playlist id, in the order of the shard.
+    """
+
+    # Read the titles and descriptions of the shard.
+    database = sqlite3.connect(databasePath)
+    videoData = readVideoRows(database, videoIds, ["Title", "Description"])
+    database.close()
+
+    # Classify the videos.
+    results = {}
+    listedVideoData = {}
+    for playlistId, (keywords, playlistVideoIds) in playlists.items():
+        playlistVideoIds = set(playlistVideoIds)
+        videoIdsToAdd = []
+        videoIdsToKeep = []
+        videoIdsToRemove = []
+        for videoId in videoIds:
+            if videoId not in videoData.keys():
+                continue
+            title, description = videoData[videoId]
+            if containsKeyword(keywords, title, description):
+                if videoId in playlistVideoIds:
+                    videoIdsToKeep.append(videoId)
+                else:
+                    videoIdsToAdd.append(videoId)
+            elif videoId in playlistVideoIds:
+                videoIdsToRemove.append(videoId)
+            else:
+                continue
+            listedVideoData[videoId] = videoData[videoId]
+        results[playlistId] = (videoIdsToAdd, videoIdsToKeep, videoIdsToRemove)
+    return listedVideoData, results
+
 
 class YouTubePlaylistStateEntry:
     def __init__(self, playlistId: str, cacheDatabase: YouTubeCacheDatabase):
@@ -48,15 +112,13 @@ class YouTubePlaylistStateEntry:
         # Iterate over the video ids.
         for videoId in videoIds:
             # Check if the video contains the keyword.
+            # Videos that aren't cached yet are skipped until the cache is updated.
             videoData = self.cacheDatabase.getCachedVideo(videoId)
-            containsKeyword = False
-            for keyword in self.keywords:
-                if keyword in videoData.title.lower() or keyword in videoData.description.lower():
-                    containsKeyword = True
-                    break
+            if videoData is None:
+                continue
 
             # Add the video.
-            if containsKeyword:
+            if containsKeyword(self.keywords, videoData.title, videoData.description):
                 if videoId in playlistVideoIds:
                     self.videosToKeep.append(videoData)
                 else:
@@ -99,15 +161,19 @@ class YouTubePlaylistStateEntry:
 
 
 class YouTubePlaylistState:
-    def __init__(self, cacheDatabase: YouTubeCacheDatabase, oauth2Api: YouTubeOAuth2Api):
+    def __init__(self, cacheDatabase: YouTubeCacheDatabase, oauth2Api: YouTubeOAuth2Api, classificationProcesses: int = 1, abortCheck: Optional[Callable[[], None]] = None):
         """Creates a playlist state.
 
         :param cacheDatabase: YouTube cache database for videos and playlists.
         :param oauth2Api: YouTube OAuth2 API helper.
+        :param classificationProcesses: Number of processes to classify videos with. 1 classifies in the current process.
+        :param abortCheck: Optional function called before adding each video that throws an error to stop adding videos.
         """
 
         self.cacheDatabase = cacheDatabase
         self.oauth2Api = oauth2Api
+        self.classificationProcesses = classificationProcesses
+        self.abortCheck = abortCheck
         self.playlistEntries: Dict[str, YouTubePlaylistStateEntry] = {}
         self.videoIds = []
 
@@ -121,6 +187,16 @@ class YouTubePlaylistState:
             if videoId not in self.videoIds:
                 self.videoIds.append(videoId)
 
+    def addVideoIds(self, videoIds: List[str]) -> None:
+        """Adds video ids to check without a source playlist.
+
+        :param videoIds: Video ids to add.
+        """
+
+        for videoId in videoIds:
+            if videoId not in self.videoIds:
+                self.videoIds.append(videoId)
+
     def addPlaylist(self, playlistId: str, keyword: str) -> None:
         """Adds a target playlist and keyword.
 
@@ -136,12 +212,85 @@ class YouTubePlaylistState:
         """Builds the lists in all the playlist entries.
         """
 
+        # Build the lists in parallel if there are enough videos.
+        if self.classificationProcesses > 1 and len(self.videoIds) >= self.classificationProcesses * MIN_VIDEOS_PER_CLASSIFICATION_PROCESS:
+            self.buildVideoListsParallel()
+            return
+
+        # Build the lists in the current process.
         for playlistEntry in self.playlistEntries.values():
             playlistEntry.reset()
             playlistEntry.readVideos(self.videoIds)
 
-    def updatePlaylists(self) -> None:
+    def buildVideoListsParallel(self) -> None:
+        """Builds the lists in all the playlist entries using a pool of processes.
+        The source video ids are split into ordered shards so the lists match building them in the current process.
+        """
+
+        # Get the current playlist ids.
+        # This is done in the current process since the listing function may fetch from YouTube.
+        playlists = {}
+        for playlistEntry in self.playlistEntries.values():
+            playlistEntry.reset()
+            playlists[playlistEntry.playlistId] = (playlistEntry.keywords, self.cacheDatabase.listPlaylistVideoIds(playlistEntry.playlistId))
+
+        # Classify the shards.
+        print("Classifying " + str(len(self.videoIds)) + " videos with " + str(self.classificationProcesses) + " processes.")
+        shardSize = -(-len(self.videoIds) // self.classificationProcesses)
+        shards = []
+        for i in range(0, len(self.videoIds), shardSize):
+            shards.append((Paths.cacheDatabasePath, self.videoIds[i:i + shardSize], playlists))
+        # Worker processes are spawned instead of forked since the background threads may be holding locks.
+        with multiprocessing.get_context("spawn").Pool(self.classificationProcesses) as pool:
+            shardResults = pool.starmap(classifyVideoShard, shards)
+
+        # Populate the video lists in the order of the shards.
+        # The videos are created from the data the workers read instead of reading them again.
+        for listedVideoData, shardResult in shardResults:
+            videos = {}
+            for videoId, (title, description) in listedVideoData.items():
+                video = Video()
+                video.id = videoId
+                video.title = title
+                video.description = description
+                videos[videoId] = video
+            for playlistId, (videoIdsToAdd, videoIdsToKeep, videoIdsToRemove) in shardResult.items():
+                playlistEntry = self.playlistEntries[playlistId]
+                playlistEntry.videosToAdd.extend([videos[videoId] for videoId in videoIdsToAdd])
+                playlistEntry.videosToKeep.extend([videos[videoId] for videoId in videoIdsToKeep])
+                playlistEntry.videosToRemove.extend([videos[videoId] for videoId in videoIdsToRemove])
+
+    def addPlaylistVideos(self) -> None:
+        """Adds the videos of the built playlist entries until the quota is reached.
+        """
+
+        quotaExceeded = False
+        completedAdditions = 0
+        pendingOperations = 0
+        with self.oauth2Api.startInsertionSession() as session:
+            for playlistEntry in self.playlistEntries.values():
+                for video in playlistEntry.videosToAdd:
+                    if quotaExceeded:
+                        pendingOperations += 1
+                    else:
+                        if self.abortCheck is not None:
+                            self.abortCheck()
+                        try:
+                            # Add the video.
+                            session.addToPlaylist(playlistEntry.playlistId, video.id)
+                            completedAdditions += 1
+                        except ConnectionError:
+                            # Print that the quota was exceeded.
+                            print("API quota was exceeded. Unable to perform any more operations for the rest of the day.")
+                            quotaExceeded = True
+                            pendingOperations += 1
+
+        print("Added " + str(completedAdditions) + " video(s) with " + str(pendingOperations) + " video(s) pending due to the resource quota. See the reports for manual actions.")
+
+    def updatePlaylists(self, writeReports: bool = True) -> None:
         """Builds the playlist entries, adds the playlist videos, and write the reports.
+
+        :param writeReports: Whether to write the reports after adding the videos.
         """
 
         # Build the video lists.
@@ -149,26 +298,11 @@ class YouTubePlaylistState:
         self.buildVideoLists()
 
         # Add the videos to the playlist.
-        quotaExceeded = False
-        completedAdditions = 0
-        pendingOperations = 0
-        for playlistEntry in self.playlistEntries.values():
-            for video in playlistEntry.videosToAdd:
-                if quotaExceeded:
-                    pendingOperations += 1
-                else:
-                    try:
-                        # Add the video.
-                        self.oauth2Api.addToPlaylist(playlistEntry.playlistId, video.id)
-                        completedAdditions += 1
-                    except ConnectionError:
-                        # Print that the quota was exceeded.
-                        print("API quota was exceeded. Unable to perform any more operations for the rest of the day.")
-                        quotaExceeded = True
-                        pendingOperations += 1
+        self.addPlaylistVideos()
 
         # Output the reports.
-        print("Added " + str(completedAdditions) + " video(s) with " + str(pendingOperations) + " video(s) pending due to the resource quota. See the reports for manual actions.")
+        if not writeReports:
+            return
         self.buildVideoLists()
         for playlistEntry in self.playlistEntries.values():
             playlistEntry.writeReport()
@@ -0,0 +1,273 @@
+"""
+TheNexusAvenger
+
+Receives YouTube upload notifications from a PubSubHubbub (WebSub) hub.
+"""
+
+import hashlib
+import hmac
+import queue
+import requests
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+staticYouTubePushNotifications = None
+
+ATOM_NAMESPACES = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+
+# Time to wait before retrying videos that the callback was unable to handle.
+RETRY_DELAY_SECONDS = 60
+
+
+class YouTubePushNotificationHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        """Handles a GET request.
+        The hub sends these to verify subscriptions.
+        """
+
+        # Parse the verification request.
+        parameters = parse_qs(urlparse(self.path).query)
+        mode = parameters.get("hub.mode", [""])[0]
+        topic = parameters.get("hub.topic", [""])[0]
+        challenge = parameters.get("hub.challenge", [""])[0]
+        leaseSeconds = parameters.get("hub.lease_seconds", [None])[0]
+        if leaseSeconds is not None:
+            try:
+                leaseSeconds = int(leaseSeconds)
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+
+        # Send the challenge back if the subscription was requested.
+        if not staticYouTubePushNotifications.verifySubscription(mode, topic, leaseSeconds):
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(bytes(challenge, "utf-8"))
+
+    def do_POST(self):
+        """Handles a POST request.
+        The hub sends these with the Atom feed of new or updated videos.
+        """
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        staticYouTubePushNotifications.handleNotification(body, self.headers.get("X-Hub-Signature"))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        """Hides the default request logging.
+        """
+
+        pass
+
+
+class YouTubePushNotifications:
+    def __init__(self, sourcePlaylistIds: List[str], callbackUrl: str, port: int, hubUrl: str, secret: str, leaseSeconds: int, videosReceivedCallback: Callable[[List[Tuple[str, str]]], bool]):
+        """Creates the push notification receiver.
+
+        :param sourcePlaylistIds: Source playlists to receive new videos for. Only channel upload playlists (starting with UU) are supported.
+        :param callbackUrl: Public URL the hub sends the notifications to.
+        :param port: Port to run the server on.
+        :param hubUrl: URL of the hub to subscribe with.
+        :param secret: Secret used to sign the notifications. Empty for no signing.
+        :param leaseSeconds: Time to request subscriptions for.
+        :param videosReceivedCallback: Callback for the source playlist ids and video ids that were received. It is called from a background thread, and returns whether the videos were handled or should be retried.
+        """
+
+        self.callbackUrl = callbackUrl
+        self.port = port
+        self.hubUrl = hubUrl
+        self.secret = secret
+        self.leaseSeconds = leaseSeconds
+        self.videosReceivedCallback = videosReceivedCallback
+        self.pendingVideos = queue.Queue()
+        self.currentServer = None
+        self.subscriptionLock = threading.Lock()
+        self.subscriptionRequestTimes: Dict[str, datetime] = {}
+        self.subscriptionExpireTimes: Dict[str, datetime] = {}
+
+        # Build the topics for the channels of the playlists.
+        self.topicPlaylistIds: Dict[str, str] = {}
+        for playlistId in sourcePlaylistIds:
+            topic = self.getTopic(playlistId)
+            if topic is None:
+                print("Playlist " + playlistId + " is not a channel upload playlist. Push notifications are not supported for it.")
+            else:
+                self.topicPlaylistIds[topic] = playlistId
+
+    def getTopic(self, playlistId: str) -> Optional[str]:
+        """Returns the topic URL for a source playlist.
+
+        :param playlistId: Playlist id to get the topic of.
+        :return: Topic URL of the channel, or None if the playlist is not the uploads of a channel.
+        """
+
+        if not playlistId.startswith("UU"):
+            return None
+        return "https://www.youtube.com/xml/feeds/videos.xml?channel_id=UC" + playlistId[2:]
+
+    def isSubscribed(self, playlistId: str) -> bool:
+        """Returns if a source playlist has an active subscription.
+
+        :param playlistId: Playlist id to check.
+        :return: Whether new videos of the playlist are being pushed.
+        """
+
+        topic = self.getTopic(playlistId)
+        with self.subscriptionLock:
+            return topic in self.subscriptionExpireTimes.keys() and self.subscriptionExpireTimes[topic] > datetime.now()
+
+    def subscribe(self) -> None:
+        """Requests subscriptions for the topics that are not subscribed or are halfway to expiring.
+        """
+
+        for topic in self.topicPlaylistIds.keys():
+            # Skip the topic if the subscription is still fresh.
+            currentTime = datetime.now()
+            with self.subscriptionLock:
+                if topic in self.subscriptionRequestTimes.keys() and (currentTime - self.subscriptionRequestTimes[topic]).total_seconds() < self.leaseSeconds / 2:
+                    continue
+                self.subscriptionRequestTimes[topic] = currentTime
+
+            # Send the subscription request.
+            print("Subscribing to push notifications for " + self.topicPlaylistIds[topic])
+            data = {
+                "hub.callback": self.callbackUrl,
+                "hub.topic": topic,
+                "hub.mode": "subscribe",
+                "hub.verify": "async",
+                "hub.lease_seconds": str(self.leaseSeconds),
+            }
+            if self.secret != "":
+                data["hub.secret"] = self.secret
+            try:
+                response = requests.post(self.hubUrl, data=data)
+                if response.status_code not in (202, 204):
+                    print("Subscription for " + self.topicPlaylistIds[topic] + " failed (HTTP " + str(response.status_code) + "): " + response.text)
+                    with self.subscriptionLock:
+                        self.subscriptionRequestTimes.pop(topic)
+            except requests.RequestException as e:
+                print("Subscription for " + self.topicPlaylistIds[topic] + " failed: " + str(e))
+                with self.subscriptionLock:
+                    self.subscriptionRequestTimes.pop(topic)
+
+    def verifySubscription(self, mode: str, topic: str, leaseSeconds: Optional[int]) -> bool:
+        """Verifies a subscription request from the hub.
+
+        :param mode: Mode of the request ("subscribe" or "unsubscribe").
+        :param topic: Topic URL of the request.
+        :param leaseSeconds: Time the subscription is active for.
+        :return: Whether the request is expected.
+        """
+
+        if topic not in self.topicPlaylistIds.keys():
+            return False
+        with self.subscriptionLock:
+            if mode == "subscribe":
+                if leaseSeconds is None:
+                    leaseSeconds = self.leaseSeconds
+                self.subscriptionExpireTimes[topic] = datetime.fromtimestamp(datetime.now().timestamp() + leaseSeconds)
+                print("Push notifications subscribed for " + self.topicPlaylistIds[topic])
+            elif mode == "unsubscribe":
+                if topic in self.subscriptionExpireTimes.keys():
+                    self.subscriptionExpireTimes.pop(topic)
+            else:
+                return False
+        return True
+
+    def handleNotification(self, body: bytes, signature: Optional[str]) -> List[str]:
+        """Handles a notification from the hub.
+        New videos are only queued so the hub gets a response without waiting for the cache or YouTube.
+
+        :param body: Atom feed of the notification.
+        :param signature: Value of the X-Hub-Signature header.
+        :return: Video ids that were queued.
+        """
+
+        # Ignore the notification if the signature is invalid.
+        if self.secret != "":
+            expectedSignature = "sha1=" + hmac.new(bytes(self.secret, "utf-8"), body, hashlib.sha1).hexdigest()
+            if signature is None or not hmac.compare_digest(signature, expectedSignature):
+                print("Ignoring push notification with an invalid signature.")
+                return []
+
+        # Parse the feed.
+        try:
+            feed = ElementTree.fromstring(body)
+        except ElementTree.ParseError:
+            print("Ignoring push notification with an invalid feed.")
+            return []
+
+        # Queue the videos.
+        # Deleted videos use a different element and are ignored.
+        videoIds = []
+        for entry in feed.findall("atom:entry", ATOM_NAMESPACES):
+            videoId = entry.findtext("yt:videoId", None, ATOM_NAMESPACES)
+            channelId = entry.findtext("yt:channelId", None, ATOM_NAMESPACES)
+            if videoId is None or channelId is None:
+                continue
+            topic = "https://www.youtube.com/xml/feeds/videos.xml?channel_id=" + channelId
+            if topic not in self.topicPlaylistIds.keys():
+                continue
+            print("Received push notification for video " + videoId)
+            self.pendingVideos.put((self.topicPlaylistIds[topic], videoId))
+            videoIds.append(videoId)
+        return videoIds
+
+    def processPendingVideos(self) -> None:
+        """Passes the queued videos to the callback.
+        This runs until the program stops.
+        """
+
+        while True:
+            # Get the queued videos.
+            pushedVideos = [self.pendingVideos.get()]
+            while not self.pendingVideos.empty():
+                pushedVideo = self.pendingVideos.get()
+                if pushedVideo not in pushedVideos:
+                    pushedVideos.append(pushedVideo)
+
+            # Pass the videos to the callback.
+            try:
+                if not self.videosReceivedCallback(pushedVideos):
+                    # Queue the videos again after a delay.
+                    print("Unable to handle " + str(len(pushedVideos)) + " pushed video(s). Retrying in " + str(RETRY_DELAY_SECONDS) + " seconds.")
+                    time.sleep(RETRY_DELAY_SECONDS)
+                    for pushedVideo in pushedVideos:
+                        self.pendingVideos.put(pushedVideo)
+            except ConnectionError:
+                print("Quota limit was reached. Pushed videos will be added in a later run.")
+            except RuntimeError as e:
+                print("Unexpected error with pushed videos: " + str(e))
+            except requests.RequestException as e:
+                print("Unable to reach YouTube for pushed videos. They will be added in a later run: " + str(e))
+            except sqlite3.Error as e:
+                print("Unable to store pushed videos. They will be added in a later run: " + str(e))
+            except Exception as e:
+                print("Unexpected error with pushed videos. They will be added in a later run: " + repr(e))
+
+    def start(self) -> None:
+        """Starts the server and the processing of videos in the background, and then subscribes.
+        """
+
+        global staticYouTubePushNotifications
+        staticYouTubePushNotifications = self
+
+        print("Starting push notification server on port " + str(self.port) + ".")
+        self.currentServer = HTTPServer(("0.0.0.0", self.port), YouTubePushNotificationHandler)
+        threading.Thread(target=self.currentServer.serve_forever, daemon=True).start()
+        threading.Thread(target=self.processPendingVideos, daemon=True).start()
+        self.subscribe()
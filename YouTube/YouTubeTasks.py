@@ -6,10 +6,24 @@ Manages tasks for the various YouTube classes.
 
 import json
 import os
+import socket
+import sqlite3
+import threading
+import uuid
 import Paths
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
 from YouTube.YouTubeCacheDatabase import YouTubeCacheDatabase
 from YouTube.YouTubeOAuth2Api import YouTubeOAuth2Api
 from YouTube.YouTubePlaylistState import YouTubePlaylistState
+from YouTube.YouTubePushNotifications import YouTubePushNotifications
+
+
+class PhaseLeaseLostError(RuntimeError):
+    """Error for when the lease of a phase is lost while the phase is being performed.
+    """
+
+    pass
 
 
 class YouTubeTasks:
@@ -27,10 +41,27 @@ class YouTubeTasks:
                         "PlaylistCacheTime": 720,
                         "VideoCacheTime": 720,
                         "RollingUpdateMaxLatestVideos": 10,
-                        "RollingUpdateMaxOldestVideos": 50
+                        "RollingUpdateMaxOldestVideos": 50,
+                        "AdaptiveUpdateMinInterval": 60,
+                        "AdaptiveUpdateMaxInterval": 43200,
+                        "AdaptiveUpdateBackoffFactor": 0.5,
+                        "AdaptiveUpdateMaxVideos": 50,
+                        "MaxCachedVideos": 0,
+                        "OrphanedVideoCacheTime": 10080,
+                        "CacheCompactionInterval": 1440
                     },
                     "Application": {
                         "TaskLoopDelayMinutes": 30,
+                        "ClassificationProcesses": 1,
+                        "PhaseLeaseTime": 10,
+                    },
+                    "PushNotifications": {
+                        "Enabled": False,
+                        "CallbackUrl": "http://PUBLIC_HOST_HERE:45983/youtube-push",
+                        "Port": 45983,
+                        "HubUrl": "https://pubsubhubbub.appspot.com/subscribe",
+                        "Secret": "",
+                        "LeaseTime": 7200
                     },
                     "SourcePlaylists": [
                         "SOURCE_PLAYLIST_ID_HERE"
@@ -62,43 +93,279 @@ class YouTubeTasks:
 
         # Set up the credentials.
         apiKey = configuration["YouTubeApiKey"]
-        self.cacheDatabase = YouTubeCacheDatabase(apiKey, configuration["Caching"]["VideoCacheTime"] * 60, configuration["Caching"]["PlaylistCacheTime"] * 60, configuration["Caching"]["RollingUpdateMaxLatestVideos"], configuration["Caching"]["RollingUpdateMaxOldestVideos"])
+        adaptiveUpdateMinInterval = self.getOptionalConfiguration("Caching", "AdaptiveUpdateMinInterval", 60)
+        adaptiveUpdateMaxInterval = self.getOptionalConfiguration("Caching", "AdaptiveUpdateMaxInterval", 43200)
+        adaptiveUpdateBackoffFactor = self.getOptionalConfiguration("Caching", "AdaptiveUpdateBackoffFactor", 0.5)
+        adaptiveUpdateMaxVideos = self.getOptionalConfiguration("Caching", "AdaptiveUpdateMaxVideos", 50)
+        self.cacheDatabase = YouTubeCacheDatabase(apiKey, configuration["Caching"]["VideoCacheTime"] * 60, configuration["Caching"]["PlaylistCacheTime"] * 60, configuration["Caching"]["RollingUpdateMaxLatestVideos"], configuration["Caching"]["RollingUpdateMaxOldestVideos"], adaptiveUpdateMinInterval * 60, adaptiveUpdateMaxInterval * 60, adaptiveUpdateBackoffFactor, adaptiveUpdateMaxVideos)
         self.oauth2Api = YouTubeOAuth2Api(apiKey, self.cacheDatabase)
+        self.pushNotifications = None
+        self.cacheLock = threading.Lock()
+        self.playlistLock = threading.Lock()
+
+        # Set up the leases for coordinating with other processes using the same cache.
+        self.leaseOwner = socket.gethostname() + ":" + str(os.getpid()) + ":" + uuid.uuid4().hex
+        self.phaseLeaseTimeSeconds = self.getOptionalConfiguration("Application", "PhaseLeaseTime", 10) * 60
+        self.phaseLeaseLostEvents: Dict[str, threading.Event] = {}
+
+    def getOptionalConfiguration(self, section: str, key: str, default):
+        """Returns an optional configuration value.
+
+        :param section: Section of the configuration the value is in.
+        :param key: Key of the value in the section.
+        :param default: Value to use if the value is not configured.
+        :return: Configured value, or the default.
+        """
+
+        if section not in self.configuration.keys() or key not in self.configuration[section].keys():
+            return default
+        return self.configuration[section][key]
+
+    def performPhase(self, phaseName: str, action: Callable[[], None]) -> bool:
+        """Performs a phase if no other process is performing it.
+        The lease for the phase is renewed in the background until the action completes.
+        If the lease is lost, the action is stopped the next time it calls checkPhaseLease.
+
+        :param phaseName: Name of the phase to perform.
+        :param action: Action of the phase.
+        :return: Whether the phase was performed.
+        """
+
+        # Return if another process is performing the phase.
+        if not self.cacheDatabase.acquireLease(phaseName, self.leaseOwner, self.phaseLeaseTimeSeconds):
+            print(phaseName + " is being performed by another process. Skipping.")
+            return False
+
+        # Renew the lease while the action runs.
+        completedEvent = threading.Event()
+        leaseLostEvent = threading.Event()
+        self.phaseLeaseLostEvents[phaseName] = leaseLostEvent
+        renewThread = threading.Thread(target=self.renewPhaseLease, args=(phaseName, completedEvent, leaseLostEvent), daemon=True)
+        renewThread.start()
+
+        # Perform the action and release the lease.
+        try:
+            action()
+        except PhaseLeaseLostError:
+            print(phaseName + " was stopped since the lease was lost.")
+            return False
+        finally:
+            completedEvent.set()
+            renewThread.join()
+            self.cacheDatabase.releaseLease(phaseName, self.leaseOwner)
+        return True
+
+    def renewPhaseLease(self, phaseName: str, completedEvent: threading.Event, leaseLostEvent: threading.Event) -> None:
+        """Renews the lease of a phase until the phase is completed.
+        If the lease is taken by another process or can't be renewed before it expires, it is treated as lost.
+
+        :param phaseName: Name of the phase to renew the lease of.
+        :param completedEvent: Event that is set when the phase is completed.
+        :param leaseLostEvent: Event to set if the lease is lost.
+        """
+
+        lastRenewTime = datetime.now()
+        while not completedEvent.wait(self.phaseLeaseTimeSeconds / 3):
+            # Try to renew the lease.
+            try:
+                if self.cacheDatabase.acquireLease(phaseName, self.leaseOwner, self.phaseLeaseTimeSeconds):
+                    lastRenewTime = datetime.now()
+                    continue
+                print("Lease for " + phaseName + " was taken by another process.")
+            except sqlite3.Error as e:
+                print("Unable to renew the lease for " + phaseName + ": " + str(e))
+                if (datetime.now() - lastRenewTime).total_seconds() < self.phaseLeaseTimeSeconds * 2 / 3:
+                    continue
+
+            # Stop the phase since the lease is lost or could expire before the next renewal.
+            leaseLostEvent.set()
+            return
+
+    def checkPhaseLease(self, phaseName: str) -> None:
+        """Throws an error if the lease of a phase being performed was lost.
+
+        :param phaseName: Name of the phase to check.
+        """
+
+        if phaseName in self.phaseLeaseLostEvents.keys() and self.phaseLeaseLostEvents[phaseName].is_set():
+            raise PhaseLeaseLostError("Lease for " + phaseName + " was lost.")
+
+    def startPushNotifications(self) -> None:
+        """Starts receiving new videos from push notifications if it is enabled.
+        """
+
+        # Return if push notifications are not enabled.
+        if not self.getOptionalConfiguration("PushNotifications", "Enabled", False):
+            return
+
+        # Start the push notifications.
+        pushConfiguration = self.configuration["PushNotifications"]
+        self.pushNotifications = YouTubePushNotifications(self.configuration["SourcePlaylists"], pushConfiguration["CallbackUrl"], pushConfiguration["Port"], pushConfiguration["HubUrl"], pushConfiguration["Secret"], pushConfiguration["LeaseTime"] * 60, self.addPushedVideos)
+        self.pushNotifications.start()
 
     def updateCache(self) -> None:
         """Updates the playlist and video cache.
         """
 
         for sourcePlaylistId in self.configuration["SourcePlaylists"]:
-            self.cacheDatabase.addNewPlaylistVideoIdsQuick(sourcePlaylistId)
-            self.cacheDatabase.updateCachedPlaylistVideos(sourcePlaylistId, self.configuration["Caching"]["PlaylistCacheUpdateMethod"])
+            # Stop if the lease was lost.
+            self.checkPhaseLease("UpdateCache")
 
-    def updatePlaylists(self) -> None:
-        """Updates the playlists.
+            # Only poll for new videos if they aren't being pushed.
+            if self.pushNotifications is None or not self.pushNotifications.isSubscribed(sourcePlaylistId):
+                self.cacheDatabase.addNewPlaylistVideoIdsQuick(sourcePlaylistId)
+            self.cacheDatabase.updateCachedPlaylistVideos(sourcePlaylistId, self.configuration["Caching"]["PlaylistCacheUpdateMethod"], lambda: self.checkPhaseLease("UpdateCache"))
+
+    def compactCache(self) -> None:
+        """Removes unreferenced videos from the cache if the compaction interval has passed.
         """
 
-        playlistState = YouTubePlaylistState(self.cacheDatabase, self.oauth2Api)
-        for sourcePlaylistId in self.configuration["SourcePlaylists"]:
-            playlistState.addSourcePlaylist(sourcePlaylistId)
+        # Read the configuration.
+        maxCachedVideos = self.getOptionalConfiguration("Caching", "MaxCachedVideos", 0)
+        orphanedVideoCacheTime = self.getOptionalConfiguration("Caching", "OrphanedVideoCacheTime", 10080)
+        cacheCompactionInterval = self.getOptionalConfiguration("Caching", "CacheCompactionInterval", 1440)
+
+        # Return if the cache was compacted recently.
+        if (datetime.now() - self.cacheDatabase.getLastCompactionTime()).total_seconds() < cacheCompactionInterval * 60:
+            return
+
+        # Compact the cache with the source and target playlists.
+        print("Compacting cache.")
+        playlistIds = list(self.configuration["SourcePlaylists"])
+        for keyword in self.configuration["TargetPlaylists"].keys():
+            playlistIds.extend(self.configuration["TargetPlaylists"][keyword])
+        self.cacheDatabase.compactCache(playlistIds, maxCachedVideos, orphanedVideoCacheTime * 60)
+
+    def createPlaylistState(self) -> YouTubePlaylistState:
+        """Creates a playlist state with the target playlists.
+
+        :return: Playlist state without any videos.
+        """
+
+        classificationProcesses = self.getOptionalConfiguration("Application", "ClassificationProcesses", 1)
+        playlistState = YouTubePlaylistState(self.cacheDatabase, self.oauth2Api, classificationProcesses, lambda: self.checkPhaseLease("UpdatePlaylists"))
         for keyword in self.configuration["TargetPlaylists"].keys():
             for playlistId in self.configuration["TargetPlaylists"][keyword]:
                 playlistState.addPlaylist(playlistId, keyword)
-        playlistState.updatePlaylists()
+        return playlistState
+
+    def performPlaylistUpdate(self, videoIds: Optional[List[str]] = None) -> None:
+        """Builds the playlist state and updates the playlists.
+        This is performed as part of the UpdatePlaylists phase since listing the playlists may update the cache.
+
+        :param videoIds: Optional video ids to add instead of the source playlists. The reports are only written for the source playlists.
+        """
+
+        playlistState = self.createPlaylistState()
+        if videoIds is None:
+            for sourcePlaylistId in self.configuration["SourcePlaylists"]:
+                playlistState.addSourcePlaylist(sourcePlaylistId)
+            playlistState.updatePlaylists()
+        else:
+            playlistState.addVideoIds(videoIds)
+            playlistState.updatePlaylists(False)
+
+    def updatePlaylists(self) -> None:
+        """Updates the playlists.
+        """
+
+        with self.playlistLock:
+            self.performPhase("UpdatePlaylists", self.performPlaylistUpdate)
+
+    def storePushedVideos(self, pushedVideos: List[Tuple[str, str]]) -> None:
+        """Stores videos received from push notifications in the cache.
+
+        :param pushedVideos: Source playlist ids and video ids that were received.
+        """
+
+        for playlistId, videoId in pushedVideos:
+            self.checkPhaseLease("UpdateCache")
+            self.cacheDatabase.addNewPlaylistVideoId(playlistId, videoId)
+        for playlistId, videoId in pushedVideos:
+            self.checkPhaseLease("UpdateCache")
+            self.cacheDatabase.updateCachedVideo(videoId)
+
+    def verifyPushedVideos(self, pushedVideos: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Returns the videos received from push notifications that were uploaded by the channel of their source playlist.
+        Notifications can be sent by anyone that can reach the server, so they aren't trusted on their own.
+
+        :param pushedVideos: Source playlist ids and video ids that were received.
+        :return: Source playlist ids and video ids that were verified.
+        """
+
+        verifiedVideos = []
+        for playlistId, videoId in pushedVideos:
+            # Channel upload playlists use the id of the channel with the "UU" prefix instead of "UC".
+            if self.cacheDatabase.getVideoChannelId(videoId) != "UC" + playlistId[2:]:
+                print("Ignoring pushed video " + videoId + " since it was not uploaded by the channel of " + playlistId + ".")
+                continue
+            verifiedVideos.append((playlistId, videoId))
+        return verifiedVideos
+
+    def addPushedVideos(self, pushedVideos: List[Tuple[str, str]]) -> bool:
+        """Stores videos received from push notifications and adds them to the playlists.
+        The reports are not updated until the next full update.
+        If another process is updating the cache, the videos are not stored so they can be retried.
+        If another process is updating the playlists, the videos are left for the next full update.
+
+        :param pushedVideos: Source playlist ids and video ids that were received.
+        :return: Whether the videos were stored.
+        """
+
+        # Ignore the videos that aren't from the source playlists.
+        pushedVideos = self.verifyPushedVideos(pushedVideos)
+        if len(pushedVideos) == 0:
+            return True
+
+        # Store the videos.
+        # This is part of updating the cache since the cached playlists would be overwritten by another update.
+        with self.cacheLock:
+            if not self.performPhase("UpdateCache", lambda: self.storePushedVideos(pushedVideos)):
+                return False
+
+        # Add the videos to the playlists.
+        videoIds = []
+        for playlistId, videoId in pushedVideos:
+            if videoId not in videoIds:
+                videoIds.append(videoId)
+        with self.playlistLock:
+            self.performPhase("UpdatePlaylists", lambda: self.performPlaylistUpdate(videoIds))
+        return True
 
     def performActions(self) -> None:
         """Performs all actions together.
         """
 
         self.oauth2Api.initializeAuthorizationHeader()
+        if self.pushNotifications is not None:
+            self.pushNotifications.subscribe()
 
+        # Update the cache.
+        # If another process is updating the cache, the playlists aren't updated since the cache may be partially updated.
+        cacheUpdateSkipped = False
         try:
-            self.updateCache()
+            with self.cacheLock:
+                cacheUpdateSkipped = not self.performPhase("UpdateCache", self.updateCache)
         except ConnectionError:
             print("Quota limit was reached. Cache can't be updated.")
+        except sqlite3.Error as e:
+            print("Unable to update the cache: " + str(e))
 
+        # Update the playlists.
         try:
-            self.updatePlaylists()
+            if cacheUpdateSkipped:
+                print("Cache was not updated. Playlists will be updated in a later run.")
+            else:
+                self.updatePlaylists()
         except ConnectionError:
             print("Quota limit was reached. Playlists can't be fetched to add videos.")
         except RuntimeError as e:
             print("Unexpected error: " + str(e))
+        except sqlite3.Error as e:
+            print("Unable to update the playlists: " + str(e))
+
+        # Compact the cache.
+        try:
+            self.performPhase("CompactCache", self.compactCache)
+        except sqlite3.Error as e:
+            print("Unable to compact the cache: " + str(e))